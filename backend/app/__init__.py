@@ -1,17 +1,13 @@
 import os
+import sys
 import click
 from flask import Flask
 from config import Config
-from flask_cors import CORS
-from sqlalchemy.dialects.postgresql import insert as pg_insert
-from app.services import forecast_service
-import matplotlib.pyplot as plt
-
-# importa o nosso serviço de ingestão de dados
-from app.services.ingest_service import process_and_consolidate_data
 
 # extensões para conexão do bd
-from .extensions import db, migrate
+from .extensions import db, migrate, cache, task_queue
+from .json_provider import OrjsonProvider
+from .utils.slug import slugify, forecast_cache_filename
 
 def create_app(config_class=Config):
     """
@@ -19,12 +15,14 @@ def create_app(config_class=Config):
     """
     app = Flask(__name__, instance_relative_config=True)
     app.config.from_object(config_class)
-    
-    # correção para aceitar req. do vue para a api via CORS
-    CORS(app, resources={r"/api/*": {"origins": "http://localhost:5173"}})
+
+    # todo jsonify() passa a serializar com orjson
+    app.json = OrjsonProvider(app)
     
     db.init_app(app)
     migrate.init_app(app, db)
+    cache.init_app(app)
+    task_queue.init_app(app)
 
     os.makedirs(app.instance_path, exist_ok=True)
 
@@ -41,50 +39,30 @@ def create_app(config_class=Config):
         """
         Comando de terminal para processar e salvar os dados pluviométricos no banco de dados.
         """
+        # importado só aqui: os outros comandos e a API não carregam o pyarrow
+        from app.services.ingest_service import process_and_consolidate_data
+
         source_path = os.path.join('data') # caminho para a pasta de dados, pode fazer juncao com outras pastas ex. ('data', '2023', etc)
         
         try:
-            # Processar e consolidar os dados dos arquivos
+            # Processa os arquivos e envia os dados direto para o banco (via COPY).
+            # 'with app.app_context()' é necessário para comandos de terminal acessarem o banco.
             click.echo(f"Iniciando leitura de dados da pasta: {source_path}")
-            consolidated_data = process_and_consolidate_data(source_path)
+            with app.app_context():
+                summary = process_and_consolidate_data(source_path)
             
-            if consolidated_data.empty:
-                click.secho("\n[AVISO] Processo de leitura concluído, mas nenhum dado foi gerado. Abortando.", fg='yellow')
+            if summary['registros_lidos'] == 0:
+                click.secho("\n[AVISO] Processo de leitura concluído, mas nenhum dado foi gerado. Nada foi salvo.", fg='yellow')
                 return
 
-            click.secho(f"\n[INFO] {len(consolidated_data)} registros lidos dos arquivos.", fg='cyan')
-            click.echo("Iniciando inserção no banco de dados...")
-            
-            # Converter o DataFrame para uma lista de dicionários
-            data_to_insert = consolidated_data.to_dict(orient='records')
-
-            # Executar a inserção em massa (bulk insert) com tratamento de conflitos
-            # 'with app.app_context()' é necessário para comandos de terminal acessarem o banco.
-            with app.app_context():
-                # Primeiro, pegamos a tabela do nosso modelo
-                table = models.PluviometricData.__table__
-
-                # Criamos a instrução de INSERT para PostgreSQL
-                stmt = pg_insert(table).values(data_to_insert)
-
-                # A parte mais importante: definimos o que fazer em caso de conflito.
-                # Se um registro com a mesma 'data' e 'estacao_codigo' já existir...
-                # ... não faça nada (on conflict do nothing).
-                stmt = stmt.on_conflict_do_nothing(
-                    index_elements=['data', 'estacao_codigo']
-                )
-                
-                # Executamos a instrução e commitamos a transação
-                db.session.execute(stmt)
-                db.session.commit()
-            
-            click.secho(f"\n[SUCESSO] Dados salvos no banco de dados!", fg='green')
+            click.secho(f"\n[INFO] {summary['registros_lidos']} registros lidos de {summary['arquivos_processados']} arquivos.", fg='cyan')
+            click.secho(f"\n[SUCESSO] {summary['registros_inseridos']} registros novos salvos no banco de dados!", fg='green')
+            if summary['estacoes_novas']:
+                click.echo(f"{summary['estacoes_novas']} estações novas cadastradas.")
             click.echo("Registros duplicados (se houver) foram ignorados.")
 
         except Exception as e:
-            # Se qualquer erro ocorrer, o rollback desfaz a transação.
-            with app.app_context():
-                db.session.rollback()
+            # Em caso de erro, o serviço já desfez a transação (rollback).
             click.secho(f"\n[ERRO] Ocorreu uma falha durante a operação com o banco de dados.", fg='red')
             click.secho(f"Detalhes: {e}", fg='red')
             click.echo("A transação foi revertida (rollback). Nenhuma alteração foi salva.")
@@ -98,41 +76,62 @@ def create_app(config_class=Config):
         Gera e exibe uma previsão de chuvas para uma cidade, usando um cache.
         Exemplo: flask generate-forecast "CURITIBANOS"
         """
+        # importado só aqui: o pmdarima/statsmodels é pesado e só a previsão usa
+        from app.services import forecast_service
+
         click.echo(f"Iniciando a geração de previsão para a cidade: {city_name}")
 
-        # Constrói o nome do arquivo de cache de forma segura
-        safe_city_name = city_name.lower().replace(' ', '_').replace('/', '_')
-        cache_filename = f"{safe_city_name}_forecast.json"
+        # Constrói o nome do arquivo de cache de forma segura (mesma regra da API)
+        safe_city_name = slugify(city_name)
         
         # 'app.instance_path' nos dá o caminho absoluto para a pasta 'instance'
-        cache_path = os.path.join(app.instance_path, cache_filename)
+        cache_path = os.path.join(app.instance_path, forecast_cache_filename(city_name))
         
         with app.app_context():
             # Passamos o caminho do cache para o serviço
-            forecast_result = forecast_service.generate_forecast_for_city(city_name, cache_path)
+            forecast_result, historical_data = forecast_service.generate_forecast_for_city(city_name, cache_path)
         
         if forecast_result is not None:
             click.secho("\n--- Resultado da Previsão ---", fg='green')
-            click.echo(forecast_result.to_string())
+            # formata a tabela direto na saída, sem montar a string inteira antes
+            forecast_result.to_string(buf=sys.stdout)
+            sys.stdout.write("\n")
 
-            with app.app_context():
-                historical_data = forecast_service._load_and_prepare_data(city_name)
-            
-            plt.figure(figsize=(15, 7))
-            plt.plot(historical_data.index, historical_data.values, label='Dados Históricos')
-            plt.plot(forecast_result['date'], forecast_result['predicted_mm'], label='Previsão', color='red', marker='o')
-            plt.fill_between(forecast_result['date'],
-                             forecast_result['conf_int_lower'],
-                             forecast_result['conf_int_upper'],
-                             color='pink', alpha=0.5, label='Intervalo de Confiança')
-            plt.title(f'Previsão de Precipitação Mensal para {city_name}')
-            plt.xlabel('Data')
-            plt.ylabel('Precipitação Total (mm)')
-            plt.legend()
-            plt.grid(True)
+            # A série histórica já vem junto da previsão; só consultamos o
+            # banco se o cache for antigo e não tiver a série salva.
+            if historical_data is None:
+                with app.app_context():
+                    historical_data = forecast_service._load_and_prepare_data(city_name)
+
+            # O matplotlib só é carregado aqui, quando há gráfico para gerar,
+            # e com o backend 'Agg' (sem interface gráfica).
+            import matplotlib
+            matplotlib.use('Agg')
+            import matplotlib.pyplot as plt
+
+            # arrays do numpy extraídos uma vez só; o matplotlib trabalha
+            # direto com eles, sem passar pelas Series do pandas.
+            dates = forecast_result['date'].to_numpy()
+            predicted = forecast_result['predicted_mm'].to_numpy()
+            conf_lower = forecast_result['conf_int_lower'].to_numpy()
+            conf_upper = forecast_result['conf_int_upper'].to_numpy()
+
+            # figura e eixos explícitos (sem o estado global do pyplot);
+            # a figura é fechada logo após salvar para liberar a memória.
+            fig, ax = plt.subplots(figsize=(15, 7))
+            ax.plot(historical_data.index.to_numpy(), historical_data.to_numpy(), label='Dados Históricos')
+            ax.plot(dates, predicted, label='Previsão', color='red', marker='o')
+            ax.fill_between(dates, conf_lower, conf_upper,
+                            color='pink', alpha=0.5, label='Intervalo de Confiança')
+            ax.set_title(f'Previsão de Precipitação Mensal para {city_name}')
+            ax.set_xlabel('Data')
+            ax.set_ylabel('Precipitação Total (mm)')
+            ax.legend()
+            ax.grid(True)
             
             filename = f'forecast_{safe_city_name}.png'
-            plt.savefig(filename)
+            fig.savefig(filename, dpi=100, bbox_inches='tight')
+            plt.close(fig)
             click.secho(f"\nGráfico da previsão salvo como '{filename}'", fg='cyan')
         else:
             click.secho(f"\nNão foi possível gerar a previsão para {city_name}.", fg='red')
@@ -1,9 +1,14 @@
 from flask import Blueprint
+from flask_cors import CORS
 
 # O primeiro argumento é o nome do blueprint.
 # O segundo é o nome do módulo/pacote, __name__ é o padrão.
 api_bp = Blueprint('api', __name__)
 
+# correção para aceitar req. do vue para a api via CORS.
+# Fica no blueprint: só as rotas da API passam pelo CORS.
+CORS(api_bp, origins=['http://localhost:5173'], supports_credentials=False)
+
 # Importamos as rotas no final para evitar importações circulares.
 # Este é um padrão comum em Flask.
 from . import routes
\ No newline at end of file
@@ -1,40 +1,70 @@
-import json
 import os
 import click
+import orjson
 from datetime import datetime
-from flask import jsonify, request, current_app
-from sqlalchemy import func, extract
+from flask import jsonify, request, current_app, Response, send_file, url_for
+from redis.exceptions import RedisError
+from rq.exceptions import NoSuchJobError
+from sqlalchemy import func, tuple_
 from . import api_bp
-from ..extensions import db
-from ..models import PluviometricData
-from ..services import forecast_service
+from ..extensions import db, cache, task_queue, CITIES_CACHE_KEY
+from ..models import PluviometricData, Station, pluv_monthly_acc
+from ..utils.slug import forecast_cache_filename
 
 # ========================
 # --- Helper Functions ---
 # ========================
 
-def _record_to_dict(record: PluviometricData):
-    """Converte um objeto PluviometricData em um dicionário."""
-    if not record:
-        return None
-    return {
-        'id': record.id,
-        'data': record.data.isoformat(),
-        'precipitacao_mm': record.precipitacao_mm,
-        'cidade': record.cidade,
-        'estado': record.estado,
-        'estacao_codigo': record.estacao_codigo
-    }
+# Colunas devolvidas pelos endpoints de registros. Selecionamos só as colunas
+# (e não o modelo inteiro) para não pagar o custo de montar objetos do ORM.
+RECORD_COLUMNS = (
+    PluviometricData.id,
+    PluviometricData.data,
+    PluviometricData.precipitacao_mm,
+    Station.cidade,
+    Station.estado,
+    Station.estacao_codigo,
+)
+
+# Quantas linhas o cursor do servidor entrega por vez no modo NDJSON
+NDJSON_YIELD_PER = 500
+
+def _ndjson_lines(engine, stmt):
+    """
+    Gera uma linha JSON por registro, lendo do cursor do servidor aos poucos.
+    Usa uma conexão própria, fora da db.session: a sessão é encerrada no
+    teardown da requisição, antes de o streaming terminar, e levaria o
+    cursor junto. A conexão é fechada quando o gerador termina ou é fechado.
+    """
+    with engine.connect() as connection:
+        rows = connection.execution_options(
+            stream_results=True, yield_per=NDJSON_YIELD_PER
+        ).execute(stmt).mappings()
+        for row in rows:
+            yield orjson.dumps(dict(row)) + b'\n'
+
+def _ndjson_body(first_line, lines):
+    """Devolve a primeira linha (já lida pela view) e depois o resto do gerador."""
+    yield first_line
+    yield from lines
+
+def _select_city_records(city_name: str):
+    """Monta o select dos registros de uma cidade, já com os dados da estação."""
+    return db.select(*RECORD_COLUMNS) \
+        .join(Station, PluviometricData.station_id == Station.id) \
+        .where(Station.cidade == city_name.upper())
 
 # =======================================
 # --- Endpoints Gerais e de Utilidade ---
 # =======================================
 
 @api_bp.route('/cities', methods=['GET'])
+@cache.cached(key_prefix=CITIES_CACHE_KEY)
 def get_available_cities():
     """
     Retorna uma lista com os nomes de todas as cidades disponíveis no banco de dados.
     Ideal para popular menus de seleção no frontend.
+    A lista fica em cache e só é descartada quando uma ingestão insere novos dados.
 
     ---
     Path:
@@ -55,7 +85,7 @@ def get_available_cities():
     """
 
     city_names = db.session.scalars(
-        db.select(PluviometricData.cidade).distinct().order_by(PluviometricData.cidade)
+        db.select(Station.cidade).distinct().order_by(Station.cidade)
     ).all()
     return jsonify(city_names)
 
@@ -66,7 +96,12 @@ def get_available_cities():
 @api_bp.route('/records/by-city/<string:city_name>', methods=['GET'])
 def get_records_by_city(city_name):
     """
-    Retorna uma lista paginada de todos os registros históricos para uma cidade.
+    Retorna uma lista paginada de todos os registros históricos para uma cidade,
+    do mais recente para o mais antigo.
+
+    A paginação é feita por cursor (keyset): em vez de um número de página,
+    o cliente envia de volta o 'next_cursor' recebido na resposta anterior.
+    Assim o banco não precisa contar nem pular registros a cada requisição.
 
     ---
     Path:
@@ -76,49 +111,99 @@ def get_records_by_city(city_name):
       - city_name (string): O nome da cidade. Ex: "CURITIBANOS"
 
     Parâmetros de Query (Opcional):
-      - page (integer): O número da página a ser retornada. (Default: 1)
       - per_page (integer): O número de registros por página. (Default: 100)
+      - after_date (string): Data do último registro da página anterior (YYYY-MM-DD).
+      - after_id (integer): Id do último registro da página anterior.
+        (after_date e after_id devem ser enviados juntos)
+      - format (string): "ndjson" para receber os registros em streaming,
+        um objeto JSON por linha (application/x-ndjson), sem o envelope
+        e sem 'next_cursor' (o cursor é a 'data' e o 'id' da última linha).
+        Os parâmetros são validados antes do streaming começar, então os
+        erros abaixo valem também para este formato.
 
     Resposta de Sucesso (200 OK):
       Content-Type: application/json
       Corpo:
-        [
-          {
-            "id": 1,
-            "data": "2024-10-12",
-            "precipitacao_mm": 10.5,
-            "cidade": "CURITIBANOS",
-            "estado": "SC",
-            "estacao_codigo": "A857"
-          },
-          ...
-        ]
+        {
+          "records": [
+            {
+              "id": 1,
+              "data": "2024-10-12",
+              "precipitacao_mm": 10.5,
+              "cidade": "CURITIBANOS",
+              "estado": "SC",
+              "estacao_codigo": "A857"
+            },
+            ...
+          ],
+          "next_cursor": {"after_date": "2024-07-05", "after_id": 4821}
+        }
+      ("next_cursor" é null na última página)
     
-    Resposta de Erro (404 Not Found):
-      - Se a cidade não for encontrada.
+    Respostas de Erro:
+      - 400 Bad Request: Se o cursor for inválido ou incompleto,
+        ou se per_page for menor que 1.
+      - 404 Not Found: Se a cidade não for encontrada.
     """
-    page = request.args.get('page', 1, type=int)
     per_page = request.args.get('per_page', 100, type=int)
-    
-    # --- INÍCIO DA CORREÇÃO ---
-    
-    # 1. Primeiro, construímos a instrução da query (o 'select' statement)
-    stmt = db.select(PluviometricData) \
-        .where(func.lower(PluviometricData.cidade) == func.lower(city_name)) \
-        .order_by(PluviometricData.data.desc())
+    after_date = request.args.get('after_date')
+    after_id = request.args.get('after_id', type=int)
 
-    # 2. Em seguida, passamos a instrução para a função db.paginate()
-    pagination = db.paginate(stmt, page=page, per_page=per_page, error_out=False)
-    
-    # 3. Os registros que queremos estão no atributo .items do objeto de paginação
-    records = pagination.items
+    if per_page < 1:
+        return jsonify({'error': 'per_page deve ser um inteiro maior que zero.'}), 400
+
+    if (after_date is None) != (after_id is None):
+        return jsonify({'error': 'Cursor incompleto. Envie after_date e after_id juntos.'}), 400
     
-    # --- FIM DA CORREÇÃO ---
+    # 1. Primeiro, construímos a instrução da query (o 'select' statement).
+    # A ordenação (data, id) é única, o que torna o cursor estável.
+    stmt = _select_city_records(city_name) \
+        .order_by(PluviometricData.data.desc(), PluviometricData.id.desc())
+
+    # 2. Se veio um cursor, continuamos a partir do último registro entregue
+    if after_date is not None:
+        try:
+            cursor_date = datetime.fromisoformat(after_date).date()
+        except ValueError:
+            return jsonify({'error': 'Formato de data inválido. Use YYYY-MM-DD.'}), 400
+        stmt = stmt.where(
+            tuple_(PluviometricData.data, PluviometricData.id) < tuple_(cursor_date, after_id)
+        )
+
+    # 3a. No modo NDJSON, as linhas vão saindo do cursor do servidor direto
+    # para a resposta, sem montar a lista inteira na memória. A primeira linha
+    # é lida antes para ainda podermos responder 404. per_page e o cursor já
+    # foram validados acima, igual ao formato JSON.
+    if request.args.get('format') == 'ndjson':
+        lines = _ndjson_lines(db.engine, stmt.limit(per_page))
+        first_line = next(lines, None)
+        if first_line is None:
+            # gerador esgotado: a conexão já foi fechada
+            if after_date is None:
+                return jsonify({'error': 'Cidade não encontrada ou sem registros'}), 404
+            return Response(b'', mimetype='application/x-ndjson')
+        response = Response(_ndjson_body(first_line, lines), mimetype='application/x-ndjson')
+        # o servidor WSGI chama isto ao fim da resposta (ou se o cliente cair),
+        # garantindo que a conexão volte ao pool
+        response.call_on_close(lines.close)
+        return response
+
+    # 3b. Buscamos um registro a mais só para saber se existe uma próxima página
+    records = db.session.execute(stmt.limit(per_page + 1)).mappings().all()
     
-    if not records:
+    if not records and after_date is None:
         return jsonify({'error': 'Cidade não encontrada ou sem registros'}), 404
+
+    next_cursor = None
+    if len(records) > per_page:
+        records = records[:per_page]
+        last = records[-1]
+        next_cursor = {'after_date': last['data'], 'after_id': last['id']}
         
-    return jsonify([_record_to_dict(rec) for rec in records])
+    return jsonify({
+        'records': [dict(rec) for rec in records],
+        'next_cursor': next_cursor
+    })
 
 @api_bp.route('/records/by-city/<string:city_name>/on-date/<string:date_str>', methods=['GET'])
 def get_record_for_city_on_date(city_name, date_str):
@@ -153,16 +238,16 @@ def get_record_for_city_on_date(city_name, date_str):
     except ValueError:
         return jsonify({'error': 'Formato de data inválido. Use YYYY-MM-DD.'}), 400
 
-    record = db.session.scalar(
-        db.select(PluviometricData)
-        .where(func.lower(PluviometricData.cidade) == func.lower(city_name))
+    record = db.session.execute(
+        _select_city_records(city_name)
         .where(PluviometricData.data == target_date)
-    )
+        .limit(1)
+    ).mappings().first()
     
     if not record:
         return jsonify({'error': f'Nenhum registro encontrado para {city_name} na data {date_str}'}), 404
         
-    return jsonify(_record_to_dict(record))
+    return jsonify(dict(record))
 
 # ==========================================
 # --- Endpoints de Análises Estatísticas ---
@@ -171,7 +256,8 @@ def get_record_for_city_on_date(city_name, date_str):
 @api_bp.route('/stats/accumulation/monthly/by-city/<string:city_name>', methods=['GET'])
 def get_monthly_accumulation(city_name):
     """
-    Calcula e retorna o acumulado de chuva mensal para uma cidade.
+    Retorna o acumulado de chuva mensal para uma cidade.
+    Os totais vêm da visão materializada 'pluv_monthly_acc', atualizada a cada ingestão.
 
     ---
     Path:
@@ -188,13 +274,12 @@ def get_monthly_accumulation(city_name):
     """
     results = db.session.execute(
         db.select(
-            extract('year', PluviometricData.data).label('ano'),
-            extract('month', PluviometricData.data).label('mes'),
-            func.sum(PluviometricData.precipitacao_mm).label('acumulado_mm')
+            pluv_monthly_acc.c.ano,
+            pluv_monthly_acc.c.mes,
+            pluv_monthly_acc.c.acumulado_mm
         )
-        .where(func.lower(PluviometricData.cidade) == func.lower(city_name))
-        .group_by('ano', 'mes')
-        .order_by('ano', 'mes')
+        .where(pluv_monthly_acc.c.cidade == city_name.upper())
+        .order_by(pluv_monthly_acc.c.ano, pluv_monthly_acc.c.mes)
     ).all()
 
     if not results:
@@ -206,7 +291,8 @@ def get_monthly_accumulation(city_name):
 @api_bp.route('/stats/accumulation/yearly/by-city/<string:city_name>', methods=['GET'])
 def get_yearly_accumulation(city_name):
     """
-    Calcula e retorna o acumulado de chuva anual para uma cidade.
+    Retorna o acumulado de chuva anual para uma cidade,
+    somando os totais mensais da visão materializada 'pluv_monthly_acc'.
 
     ---
     Path:
@@ -223,12 +309,12 @@ def get_yearly_accumulation(city_name):
     """
     results = db.session.execute(
         db.select(
-            extract('year', PluviometricData.data).label('ano'),
-            func.sum(PluviometricData.precipitacao_mm).label('acumulado_mm')
+            pluv_monthly_acc.c.ano,
+            func.sum(pluv_monthly_acc.c.acumulado_mm).label('acumulado_mm')
         )
-        .where(func.lower(PluviometricData.cidade) == func.lower(city_name))
-        .group_by('ano')
-        .order_by('ano')
+        .where(pluv_monthly_acc.c.cidade == city_name.upper())
+        .group_by(pluv_monthly_acc.c.ano)
+        .order_by(pluv_monthly_acc.c.ano)
     ).all()
 
     if not results:
@@ -260,17 +346,17 @@ def get_city_extremes(city_name):
         }
     """
     # Encontra o dia mais chuvoso
-    rainiest_day = db.session.scalar(
-        db.select(PluviometricData)
-        .where(func.lower(PluviometricData.cidade) == func.lower(city_name))
+    rainiest_day = db.session.execute(
+        _select_city_records(city_name)
         .order_by(PluviometricData.precipitacao_mm.desc())
-    )
+        .limit(1)
+    ).mappings().first()
     
     if not rainiest_day:
         return jsonify({'error': 'Cidade não encontrada ou sem registros'}), 404
         
     return jsonify({
-        'dia_mais_chuvoso': _record_to_dict(rainiest_day)
+        'dia_mais_chuvoso': dict(rainiest_day)
     })
 
 # ==============================
@@ -303,14 +389,15 @@ def get_forecast(city_name):
           ]
         }
     
+    Resposta Condicional (304 Not Modified):
+      - Se o cabeçalho If-None-Match (ou If-Modified-Since) indicar que o
+        cliente já tem a versão atual do arquivo de cache.
+    
     Resposta de Erro (404 Not Found):
       - Se o arquivo de cache da previsão ainda não foi gerado.
     """
-    safe_city_name = city_name.lower().replace(' ', '_').replace('/', '_')
-    cache_filename = f"{safe_city_name}_forecast.json"
-    
     # Usamos 'current_app' para acessar o app context e encontrar a pasta 'instance'
-    cache_path = os.path.join(current_app.instance_path, cache_filename)
+    cache_path = os.path.join(current_app.instance_path, forecast_cache_filename(city_name))
 
     if not os.path.exists(cache_path):
         return jsonify({
@@ -318,15 +405,17 @@ def get_forecast(city_name):
             'message': f'Execute o comando "flask generate-forecast \'{city_name}\'" no servidor para gerá-la.'
         }), 404
 
-    with open(cache_path, 'r', encoding='utf-8') as f:
-        forecast_data = json.load(f)
-    
-    return jsonify(forecast_data)
+    # O arquivo de cache já é o JSON da resposta: enviamos os bytes direto,
+    # sem decodificar e serializar de novo. Com conditional=True o Flask cuida
+    # do ETag/Last-Modified e responde 304 quando o cliente já tem esta versão.
+    return send_file(cache_path, mimetype='application/json', conditional=True)
 
 @api_bp.route('/forecast/by-city/<string:city_name>', methods=['POST'])
 def create_or_update_forecast(city_name):
     """
-    Aciona a geração (ou atualização) do cache da previsão. É uma operação LENTA.
+    Aciona a geração (ou atualização) do cache da previsão.
+    A geração é LENTA, então ela é enviada para a fila de tarefas (RQ) e a
+    resposta volta na hora, com o endereço para acompanhar o andamento.
 
     ---
     Path:
@@ -335,46 +424,87 @@ def create_or_update_forecast(city_name):
     Parâmetros de Entrada:
       Nenhum no corpo da requisição.
 
-    Resposta de Sucesso (201 Created):
+    Resposta de Sucesso (202 Accepted):
       Content-Type: application/json
       Corpo:
         {
-          "status": "success",
-          "message": "Previsão para CURITIBANOS foi gerada e salva com sucesso.",
-          "cache_path": "C:\\...\\instance\\curitibanos_forecast.json"
+          "status": "queued",
+          "task_id": "3f6c1d0e-...",
+          "status_url": "/api/v1/forecast/status/3f6c1d0e-..."
         }
     
     Respostas de Erro:
-      - 400 Bad Request: Se não houver dados suficientes para gerar a previsão.
-      - 500 Internal Server Error: Se ocorrer um erro inesperado no modelo.
+      - 500 Internal Server Error: Se não for possível enfileirar a tarefa.
     """
     click.echo(f"Requisição POST recebida para gerar previsão para: {city_name}")
 
-    safe_city_name = city_name.lower().replace(' ', '_').replace('/', '_')
-    cache_filename = f"{safe_city_name}_forecast.json"
-    cache_path = os.path.join(current_app.instance_path, cache_filename)
+    cache_path = os.path.join(current_app.instance_path, forecast_cache_filename(city_name))
 
-    # Forçamos a geração chamando o serviço diretamente.
-    # Em uma aplicação de produção, isso seria delegado a uma fila de tarefas (Celery, RQ).
+    # A tarefa é referenciada pelo caminho, assim a API não precisa importar
+    # o serviço de previsão; quem executa é o worker.
     try:
-        # A chamada ao forecast_service já contém a lógica de salvar o cache
-        forecast_result = forecast_service.generate_forecast_for_city(city_name, cache_path, force_regenerate=True)
-        
-        if forecast_result is None:
-            # Isso pode acontecer se não houver dados suficientes para a cidade
-             return jsonify({
-                'error': 'Não foi possível gerar a previsão.',
-                'message': f'Verifique se existem dados suficientes para a cidade "{city_name}".'
-            }), 400
-
+        job = task_queue.enqueue(
+            'app.tasks.generate_forecast_task',
+            city_name, cache_path,
+            job_timeout=current_app.config['FORECAST_JOB_TIMEOUT']
+        )
+    except Exception as e:
         return jsonify({
-            'status': 'success',
-            'message': f'Previsão para {city_name} foi gerada e salva com sucesso.',
-            'cache_path': cache_path
-        }), 201 # 201 Created indica que um recurso foi criado com sucesso
+            'status': 'error',
+            'message': f'Não foi possível enfileirar a geração da previsão: {str(e)}'
+        }), 500
 
-    except Exception as e:
+    return jsonify({
+        'status': 'queued',
+        'task_id': job.id,
+        'status_url': url_for('api.get_forecast_status', task_id=job.id)
+    }), 202 # 202 Accepted: a requisição foi aceita, mas ainda será processada
+
+@api_bp.route('/forecast/status/<string:task_id>', methods=['GET'])
+def get_forecast_status(task_id):
+    """
+    Retorna o andamento de uma geração de previsão enfileirada pelo POST.
+
+    ---
+    Path:
+      GET /api/v1/forecast/status/<task_id>
+    
+    Resposta de Sucesso (200 OK):
+      Content-Type: application/json
+      Corpo:
+        {
+          "task_id": "3f6c1d0e-...",
+          "status": "finished",
+          "message": "Previsão para CURITIBANOS foi gerada e salva com sucesso."
+        }
+      ("status" pode ser: queued, started, deferred, scheduled, finished, failed,
+       stopped ou canceled. finished, failed, stopped e canceled são finais.
+       Em caso de falha, "message" traz o motivo.)
+    
+    Respostas de Erro:
+      - 404 Not Found: Se a tarefa não existir (ou já tiver expirado).
+      - 503 Service Unavailable: Se não for possível consultar a fila (Redis).
+    """
+    # Todas as leituras abaixo vão ao Redis; se ele cair, a resposta continua
+    # sendo JSON (o frontend lê o corpo de toda resposta do polling).
+    try:
+        job = task_queue.fetch_job(task_id)
+
+        status = job.get_status()
+        body = {'task_id': job.id, 'status': status.value if status else None}
+
+        if job.is_finished:
+            body.update(job.return_value() or {})
+        elif job.is_failed:
+            # A última linha do traceback traz a exceção e a mensagem
+            exc_info = (job.exc_info or '').strip().splitlines()
+            body['message'] = exc_info[-1] if exc_info else 'Falha desconhecida ao gerar a previsão.'
+    except NoSuchJobError:
+        return jsonify({'error': 'Tarefa não encontrada.'}), 404
+    except RedisError as e:
         return jsonify({
             'status': 'error',
-            'message': f'Ocorreu um erro interno: {str(e)}'
-        }), 500
\ No newline at end of file
+            'message': f'Não foi possível consultar o andamento da previsão: {str(e)}'
+        }), 503
+
+    return jsonify(body)
@@ -1,8 +1,41 @@
 from flask_sqlalchemy import SQLAlchemy
 from flask_migrate import Migrate
+from flask_caching import Cache
+from redis import Redis
+from rq import Queue
+from rq.job import Job
 
 # Instancia as extensões sem associá-las a nenhuma aplicação ainda.
 # Elas estão "desligadas" até que a factory as conecte, para evitar
 # problemas de importação circular.
 db = SQLAlchemy()
-migrate = Migrate()
\ No newline at end of file
+migrate = Migrate()
+cache = Cache()
+
+
+class TaskQueue:
+    """
+    Fila de tarefas (RQ) para operações lentas, como a geração de previsões.
+    Segue o padrão das outras extensões: é instanciada aqui e só se conecta
+    ao Redis quando a factory chama init_app.
+    """
+    def __init__(self):
+        self.queue = None
+
+    def init_app(self, app):
+        connection = Redis.from_url(app.config['REDIS_URL'])
+        self.queue = Queue(app.config['TASK_QUEUE_NAME'], connection=connection)
+        app.extensions['task_queue'] = self
+
+    def enqueue(self, func, *args, **kwargs) -> Job:
+        return self.queue.enqueue(func, *args, **kwargs)
+
+    def fetch_job(self, job_id: str) -> Job:
+        return Job.fetch(job_id, connection=self.queue.connection)
+
+
+task_queue = TaskQueue()
+
+# Chave do cache da lista de cidades. Fica aqui porque tanto a rota
+# quanto a ingestão (que invalida o cache) precisam dela.
+CITIES_CACHE_KEY = 'cities'
@@ -0,0 +1,34 @@
+import decimal
+import orjson
+from flask.json.provider import JSONProvider
+
+# datas/datetimes saem em ISO 8601 ('2023-01-31'), e arrays/escalares do
+# numpy são serializados direto, sem passar por listas do Python.
+ORJSON_OPTIONS = orjson.OPT_NAIVE_UTC | orjson.OPT_SERIALIZE_NUMPY
+
+
+def _default(obj):
+    """Tipos que o orjson não conhece por conta própria."""
+    if isinstance(obj, decimal.Decimal):
+        return float(obj)
+    raise TypeError(f"Objeto do tipo {type(obj).__name__} não é serializável em JSON")
+
+
+class OrjsonProvider(JSONProvider):
+    """
+    Provedor de JSON do Flask baseado no orjson. Registrado na factory
+    (app.json), faz com que todo jsonify() da API use o orjson.
+    """
+    def dumps(self, obj, **kwargs) -> str:
+        return orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Monta a resposta direto com os bytes do orjson, sem o decode do dumps()
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(
+            orjson.dumps(obj, default=_default, option=ORJSON_OPTIONS),
+            mimetype='application/json',
+        )
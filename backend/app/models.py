@@ -1,5 +1,25 @@
+from sqlalchemy import table, column
 from .extensions import db
 
+class Station(db.Model):
+    """
+    Estações meteorológicas do INMET e a cidade onde cada uma fica.
+    Os registros diários apontam para cá, em vez de repetir nome da cidade,
+    UF e código da estação em todas as linhas.
+    """
+    __tablename__ = 'stations'
+
+    id = db.Column(db.SmallInteger, primary_key=True)
+    cidade = db.Column(db.String(100), nullable=False, index=True)
+    estado = db.Column(db.String(2), nullable=False)
+    estacao_codigo = db.Column(db.String(10), nullable=False, unique=True)
+
+    def __repr__(self):
+        """
+        Representação em string do objeto
+        """
+        return f"<Station {self.estacao_codigo} ({self.cidade}/{self.estado})>"
+
 class PluviometricData(db.Model):
     """
     Modelo de dados para armazenar os registros diários de precipitação.
@@ -9,18 +29,32 @@ class PluviometricData(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     data = db.Column(db.Date, nullable=False, index=True)
     precipitacao_mm = db.Column(db.Float, nullable=False)
-    cidade = db.Column(db.String(100), nullable=False)
-    estado = db.Column(db.String(2), nullable=False)
-    estacao_codigo = db.Column(db.String(10), nullable=False, index=True)
+    station_id = db.Column(db.SmallInteger, db.ForeignKey('stations.id'), nullable=False)
 
-    # Restrição para garantir que não haja entradas duplicadas para a mesma
-    # estação no mesmo dia.
     __table_args__ = (
-        db.UniqueConstraint('data', 'estacao_codigo', name='_data_estacao_uc'),
+        # Restrição para garantir que não haja entradas duplicadas para a mesma
+        # estação no mesmo dia.
+        db.UniqueConstraint('data', 'station_id', name='_data_estacao_uc'),
+        # Índice da paginação por cursor: registros de uma estação,
+        # do mais recente para o mais antigo. A precipitação vai no INCLUDE
+        # para que a listagem e a busca por data não precisem ler a tabela.
+        db.Index('ix_pluv_station_data_id', station_id, data.desc(), id.desc(),
+                 postgresql_include=['precipitacao_mm']),
     )
 
     def __repr__(self):
         """
         Representação em string do objeto
         """
-        return f"<PluviometricData {self.estacao_codigo} em {self.data}: {self.precipitacao_mm}mm>"
\ No newline at end of file
+        return f"<PluviometricData estação {self.station_id} em {self.data}: {self.precipitacao_mm}mm>"
+
+# Visão materializada com o acumulado mensal de chuva por cidade.
+# Ela é criada por migração e atualizada ao final de cada ingestão, por isso
+# é declarada com 'table()' (fora do metadata dos modelos) apenas para consultas.
+pluv_monthly_acc = table(
+    'pluv_monthly_acc',
+    column('cidade'),
+    column('ano'),
+    column('mes'),
+    column('acumulado_mm'),
+)
@@ -1,11 +1,14 @@
 import pandas as pd
+import numpy as np
 import pmdarima as pm
-from sqlalchemy import func
-from ..models import PluviometricData
+from ..models import PluviometricData, Station
 from ..extensions import db
+from sqlalchemy import func
 import warnings
 import os
 import json
+import hashlib
+import orjson
 from datetime import datetime, timedelta
 
 # Ignorar avisos comuns do statsmodels para deixar a saída mais limpa
@@ -15,18 +18,33 @@ warnings.filterwarnings("ignore", category=UserWarning, module='statsmodels')
 MINIMUM_DATA_POINTS = 3 * 12
 CACHE_LIFETIME_DAYS = 7
 
+# Quanto o AIC de um modelo reaproveitado pode piorar (em relação ao AIC
+# salvo quando os parâmetros foram encontrados) antes de refazermos a busca.
+MODEL_AIC_TOLERANCE = 0.10
+
+def _orjson_default(obj):
+    """
+    Serializa os tipos que o orjson não conhece, como o pd.Timestamp das datas da previsão.
+    """
+    if isinstance(obj, pd.Timestamp):
+        return obj.isoformat()
+    raise TypeError(f"Tipo não serializável em JSON: {type(obj).__name__}")
+
 def _load_and_prepare_data(city_name: str) -> pd.Series:
     """
     Carrega os dados de uma cidade do banco, valida e prepara a série temporal mensal.
     """
     print(f"Carregando dados históricos para '{city_name}' do banco de dados...")
 
-    # Query para buscar os dados da cidade, ignorando maiúsculas/minúsculas
+    # Query para buscar os dados da cidade. Os nomes são gravados em
+    # maiúsculas na ingestão, então basta normalizar o parâmetro.
     stmt = db.select(
         PluviometricData.data,
         PluviometricData.precipitacao_mm
+    ).join(
+        Station, PluviometricData.station_id == Station.id
     ).where(
-        func.lower(PluviometricData.cidade) == func.lower(city_name)
+        Station.cidade == city_name.upper()
     ).order_by(
         PluviometricData.data
     )
@@ -58,7 +76,96 @@ def _load_and_prepare_data(city_name: str) -> pd.Series:
     print(f"Dados carregados e agregados. Série temporal de {monthly_series.index.min().year} a {monthly_series.index.max().year} encontrada.")
     return monthly_series
 
-def _find_best_model(monthly_series: pd.Series):
+def _data_tag(city_name: str) -> str:
+    """
+    Identifica o estado dos dados de uma cidade (data mais recente e número de
+    registros). Se uma ingestão trouxer dados novos, o tag muda e o cache
+    da previsão deixa de valer, mesmo dentro do prazo.
+    """
+    max_data, count = db.session.execute(
+        db.select(func.max(PluviometricData.data), func.count())
+        .join(Station, PluviometricData.station_id == Station.id)
+        .where(Station.cidade == city_name.upper())
+    ).one()
+    return hashlib.sha1(f"{max_data}:{count}".encode()).hexdigest()[:12]
+
+def _model_params_path(cache_path: str) -> str:
+    """
+    Caminho do arquivo com os parâmetros do modelo, ao lado do cache da previsão.
+    Ex: curitibanos_forecast.json -> curitibanos_forecast.model.json
+    """
+    return f"{os.path.splitext(cache_path)[0]}.model.json"
+
+def _history_path(cache_path: str) -> str:
+    """
+    Caminho da série histórica mensal usada na previsão, ao lado do cache.
+    Ex: curitibanos_forecast.json -> curitibanos_forecast.history.parquet
+    """
+    return f"{os.path.splitext(cache_path)[0]}.history.parquet"
+
+def _save_history(history_path: str, monthly_series: pd.Series):
+    """
+    Salva a série histórica em parquet, para quem for desenhar o gráfico
+    não precisar consultar o banco de novo enquanto o cache valer.
+    """
+    try:
+        monthly_series.to_frame().to_parquet(history_path, compression='zstd')
+    except Exception as e:
+        print(f"[AVISO] Não foi possível salvar a série histórica em {history_path}: {e}")
+
+def _load_history(history_path: str):
+    """
+    Lê a série histórica salva junto do cache, se existir.
+    """
+    if not os.path.exists(history_path):
+        return None
+    try:
+        return pd.read_parquet(history_path)['precipitacao_mm']
+    except Exception as e:
+        print(f"[AVISO] Não foi possível ler a série histórica em {history_path}: {e}")
+        return None
+
+def _load_model_params(params_path: str):
+    """
+    Lê os parâmetros salvos do modelo de uma cidade, se existirem.
+    """
+    if not os.path.exists(params_path):
+        return None
+    try:
+        with open(params_path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"[AVISO] Não foi possível ler os parâmetros salvos em {params_path}: {e}")
+        return None
+
+def _save_model_params(params_path: str, arima_model):
+    """
+    Salva a ordem do modelo encontrado pelo auto_arima e o seu AIC de referência.
+    """
+    params = {
+        "order": list(arima_model.order),
+        "seasonal_order": list(arima_model.seasonal_order),
+        "with_intercept": bool(arima_model.with_intercept),
+        "aic": float(arima_model.aic()),
+        "searched_at": datetime.now().isoformat()
+    }
+    with open(params_path, 'w') as f:
+        json.dump(params, f, indent=4)
+
+def _fit_saved_model(monthly_series: pd.Series, params: dict):
+    """
+    Ajusta um único modelo SARIMA com os parâmetros já conhecidos da cidade.
+    """
+    print(f"Ajustando modelo SARIMA{tuple(params['order'])}x{tuple(params['seasonal_order'])} com parâmetros salvos...")
+    arima_model = pm.ARIMA(
+        order=tuple(params['order']),
+        seasonal_order=tuple(params['seasonal_order']),
+        with_intercept=params.get('with_intercept', True),
+        suppress_warnings=True
+    )
+    return arima_model.fit(monthly_series)
+
+def _search_best_model(monthly_series: pd.Series):
     """
     Usa auto_arima para encontrar o melhor modelo SARIMA para a série temporal.
     """
@@ -82,27 +189,63 @@ def _find_best_model(monthly_series: pd.Series):
     print(f"Melhor modelo encontrado: {arima_model.summary().tables[0].as_text()}")
     return arima_model
 
-def generate_forecast_for_city(city_name: str, cache_path: str, n_months: int = 12, force_regenerate: bool = False) -> pd.DataFrame:
+def _find_best_model(monthly_series: pd.Series, params_path: str):
+    """
+    Retorna o modelo SARIMA da cidade. A busca do auto_arima (que ajusta dezenas
+    de modelos) só é feita quando não há parâmetros salvos ou quando o modelo
+    com os parâmetros salvos ficou pior que o esperado; caso contrário, ajustamos
+    um único modelo com a ordem já conhecida.
+    """
+    params = _load_model_params(params_path)
+
+    if params is not None:
+        try:
+            arima_model = _fit_saved_model(monthly_series, params)
+            aic_limit = params['aic'] + abs(params['aic']) * MODEL_AIC_TOLERANCE
+            if arima_model.aic() <= aic_limit:
+                print(f"Modelo com parâmetros salvos aceito (AIC {arima_model.aic():.2f}, referência {params['aic']:.2f}).")
+                return arima_model
+            print(f"AIC piorou demais ({arima_model.aic():.2f}, referência {params['aic']:.2f}). Refazendo a busca.")
+        except Exception as e:
+            print(f"[AVISO] Falha ao ajustar o modelo com os parâmetros salvos: {e}. Refazendo a busca.")
+
+    arima_model = _search_best_model(monthly_series)
+    _save_model_params(params_path, arima_model)
+    return arima_model
+
+def generate_forecast_for_city(city_name: str, cache_path: str, n_months: int = 12, force_regenerate: bool = False) -> tuple:
     """
     Função principal do serviço. Orquestra o processo de geração de previsão,
     limpa os dados e enriquece o resultado com insights de tendência.
     Permite também o uso de cache para evitar recomputações desnecessárias.
+    Retorna (forecast_df, serie_historica_mensal). A série é None se o cache
+    não tiver a série salva; em caso de erro, retorna (None, None).
     """
+    # Falhas aqui (ex: banco fora do ar) são tratadas como as da geração:
+    # mensagem no log e (None, None) para quem chamou.
+    try:
+        data_tag = _data_tag(city_name)
+    except Exception as e:
+        print(f"[ERRO] Não foi possível consultar os dados de '{city_name}': {e}")
+        return None, None
+
     # Verificação do cache
     if not force_regenerate and os.path.exists(cache_path):
         print(f"Arquivo de cache encontrado para '{city_name}'. Verificando validade...")
-        with open(cache_path, 'r') as f:
-            cache_data = json.load(f)
+        with open(cache_path, 'rb') as f:
+            cache_data = orjson.loads(f.read())
         
         generated_at = datetime.fromisoformat(cache_data['generated_at'])
         cache_age = datetime.now() - generated_at
         
-        if cache_age < timedelta(days=CACHE_LIFETIME_DAYS):
+        if cache_data.get('data_tag') != data_tag:
+            print("Cache DESATUALIZADO (os dados da cidade mudaram). Gerando nova previsão.")
+        elif cache_age < timedelta(days=CACHE_LIFETIME_DAYS):
             print(f"Cache VÁLIDO (criado há {cache_age.days} dias). Carregando previsão do arquivo.")
             # Converte os dados do cache de volta para um df
             forecast_df = pd.DataFrame(cache_data['forecast'])
             forecast_df['date'] = pd.to_datetime(forecast_df['date'])
-            return forecast_df
+            return forecast_df, _load_history(_history_path(cache_path))
         else:
             print(f"Cache EXPIRADO (criado há {cache_age.days} dias). Gerando nova previsão.")
 
@@ -112,8 +255,8 @@ def generate_forecast_for_city(city_name: str, cache_path: str, n_months: int =
         # Carrega e prepara os dados históricos (lá do banco de dados)
         monthly_series = _load_and_prepare_data(city_name)
 
-        # seleciona o melhor modelo SARIMA
-        model = _find_best_model(monthly_series)
+        # seleciona o melhor modelo SARIMA (reaproveitando os parâmetros salvos)
+        model = _find_best_model(monthly_series, _model_params_path(cache_path))
 
         # Gera previsão bruta
         forecast, conf_int = model.predict(n_periods=n_months, return_conf_int=True)
@@ -145,17 +288,23 @@ def generate_forecast_for_city(city_name: str, cache_path: str, n_months: int =
         # Calcula a média histórica para cada mês do ano
         historical_monthly_avg = monthly_series.groupby(monthly_series.index.month).mean()
         
-        # determina a tendência
-        def get_trend(row):
-            month = row['date'].month
-            prediction = row['predicted_mm']
-            historical_avg = historical_monthly_avg.get(month, 0)
-            if historical_avg == 0: return "Sem referência histórica"
-            if prediction > historical_avg * 1.15: return "Acima da média histórica"
-            if prediction < historical_avg * 0.85: return "Abaixo da média histórica"
-            return "Dentro da média histórica"
-
-        forecast_df['tendencia'] = forecast_df.apply(get_trend, axis=1)
+        # determina a tendência de todos os meses previstos de uma vez.
+        # A ordem das condições importa: np.select usa a primeira verdadeira.
+        historical_avg = forecast_df['date'].dt.month.map(historical_monthly_avg).fillna(0).to_numpy()
+        prediction = forecast_df['predicted_mm'].to_numpy()
+        forecast_df['tendencia'] = np.select(
+            [
+                historical_avg == 0,
+                prediction > historical_avg * 1.15,
+                prediction < historical_avg * 0.85,
+            ],
+            [
+                "Sem referência histórica",
+                "Acima da média histórica",
+                "Abaixo da média histórica",
+            ],
+            default="Dentro da média histórica"
+        )
 
         # SALVAR O NOVO CACHE
         print(f"Salvando nova previsão no cache em: {cache_path}")
@@ -167,22 +316,22 @@ def generate_forecast_for_city(city_name: str, cache_path: str, n_months: int =
                 monthly_series.index.max().isoformat()
             ],
             "forecast": forecast_df.to_dict('records'),
-            "generated_at": datetime.now().isoformat()
+            "generated_at": datetime.now().isoformat(),
+            "data_tag": data_tag
         }
         
-        # Converte as datas no forecast para string para serem compatíveis com JSON
-        for record in output_data['forecast']:
-            record['date'] = record['date'].isoformat()
-            
-        with open(cache_path, 'w') as f:
-            json.dump(output_data, f, indent=4)
+        # O orjson já serializa floats/arrays do NumPy; as datas (pd.Timestamp)
+        # são convertidas pelo _orjson_default.
+        with open(cache_path, 'wb') as f:
+            f.write(orjson.dumps(output_data, default=_orjson_default, option=orjson.OPT_SERIALIZE_NUMPY))
+        _save_history(_history_path(cache_path), monthly_series)
 
         print("Previsão gerada e salva com sucesso.")
-        return forecast_df
+        return forecast_df, monthly_series
 
     except ValueError as ve:
         print(f"[AVISO] {ve}")
-        return None
+        return None, None
     except Exception as e:
         print(f"[ERRO] Ocorreu um erro inesperado: {e}")
-        return None
\ No newline at end of file
+        return None, None
\ No newline at end of file
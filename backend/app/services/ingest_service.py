@@ -1,127 +1,387 @@
-import pandas as pd
-import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.csv as pacsv
+import io
 import os
-import glob
+import re
+from itertools import chain
+from concurrent.futures import ProcessPoolExecutor
+from flask import current_app
+from ..extensions import db, cache, CITIES_CACHE_KEY
 
-def _process_single_file(file_path: str) -> pd.DataFrame:
+# Ordem das colunas enviadas ao banco. O COPY depende dela, então a
+# tabela de cada arquivo é sempre reordenada com esta lista.
+COPY_COLUMNS = ['data', 'precipitacao_mm', 'cidade', 'estado', 'estacao_codigo']
+
+# O COPY vai para uma tabela temporária (sem índices nem restrições), ainda
+# com os dados da estação em cada linha. De lá, as estações novas entram na
+# tabela 'stations' e os registros entram em 'pluviometric_data' apontando
+# para elas, ignorando registros duplicados.
+STAGING_TABLE = 'pluv_staging'
+
+CREATE_STAGING_SQL = f"""
+    CREATE TEMP TABLE {STAGING_TABLE} (
+        data date,
+        precipitacao_mm double precision,
+        cidade varchar(100),
+        estado varchar(2),
+        estacao_codigo varchar(10)
+    ) ON COMMIT DROP
+"""
+COPY_SQL = f"COPY {STAGING_TABLE} ({','.join(COPY_COLUMNS)}) FROM STDIN WITH CSV"
+INSERT_STATIONS_SQL = f"""
+    INSERT INTO stations (cidade, estado, estacao_codigo)
+    SELECT DISTINCT ON (estacao_codigo) cidade, estado, estacao_codigo
+    FROM {STAGING_TABLE}
+    ORDER BY estacao_codigo, data DESC
+    ON CONFLICT (estacao_codigo) DO NOTHING
+"""
+INSERT_FROM_STAGING_SQL = f"""
+    INSERT INTO pluviometric_data (data, precipitacao_mm, station_id)
+    SELECT stg.data, stg.precipitacao_mm, s.id
+    FROM {STAGING_TABLE} stg
+    JOIN stations s ON s.estacao_codigo = stg.estacao_codigo
+    ON CONFLICT (data, station_id) DO NOTHING
+"""
+
+# Metadados da estação, nas primeiras linhas de cada arquivo. A grafia da chave
+# da estação muda entre os anos ("ESTAÇÃO:", "ESTAC?O:", "ESTACAO:"), por isso
+# aceitamos qualquer chave que comece com "ESTA".
+HEADER_READ_SIZE = 2048
+HEADER_RE = re.compile(r'^(ESTA[^:\r\n]*|UF|CODIGO \(WMO\)):;([^;\r\n]*)', re.MULTILINE)
+HEADER_FIELDS = {'UF': 'estado', 'CODIGO (WMO)': 'estacao_codigo'}
+
+# Opções do leitor CSV do PyArrow para os arquivos do INMET.
+# As 8 primeiras linhas são metadados da estação; os números usam vírgula
+# decimal; e dados que não são registrados, não aconteceram ou foram
+# invalidados aparecem como "-9999" (ou vazios) -> viram nulos já na leitura.
+# As datas vêm como 2009-01-01 nos arquivos antigos e 2024/01/01 nos novos.
+# Só as colunas de data e precipitação são convertidas, com os tipos já
+# declarados (sem inferência); os nomes delas mudam entre os anos, então as
+# opções de conversão são montadas por arquivo a partir da linha de colunas.
+CSV_HEADER_ROWS = 8
+# O paralelismo é entre arquivos (um processo por núcleo); as threads do próprio
+# leitor só disputariam os mesmos núcleos, então ficam desligadas.
+CSV_READ_OPTIONS = pacsv.ReadOptions(skip_rows=CSV_HEADER_ROWS, encoding='latin-1', use_threads=False)
+CSV_PARSE_OPTIONS = pacsv.ParseOptions(delimiter=';')
+CSV_CONVERT_ARGS = {
+    'null_values': ['', '-9999'],
+    'decimal_point': ',',
+    'timestamp_parsers': ['%Y-%m-%d', '%Y/%m/%d'],
+}
+# A tabela já processada é escrita de volta em CSV pelo próprio PyArrow,
+# sem cabeçalho, para o COPY.
+COPY_WRITE_OPTIONS = pacsv.WriteOptions(include_header=False)
+# Cada arquivo tem só algumas centenas de dias; eles são agrupados em blocos
+# de até ~50 mil linhas por COPY. Poucas idas ao banco, e a memória fica
+# limitada a um bloco, não ao diretório inteiro.
+COPY_CHUNK_ROWS = 50_000
+
+# Ajustes que valem só para a transação da ingestão (SET LOCAL volta ao
+# padrão no commit):
+# - a ingestão pode ser refeita do zero a qualquer momento, então não
+#   precisamos esperar o fsync do WAL no commit;
+# - mais memória para o hash/sort do INSERT ... SELECT e do DISTINCT ON,
+#   e para a recriação dos índices secundários;
+# - sem o statement_timeout das conexões da API: uma carga grande pode
+#   levar mais que isso legitimamente.
+INGEST_SETTINGS_SQL = (
+    "SET LOCAL synchronous_commit = OFF",
+    "SET LOCAL statement_timeout = 0",
+    "SET LOCAL work_mem = '256MB'",
+    "SET LOCAL maintenance_work_mem = '512MB'",
+)
+
+# Índices secundários de 'pluviometric_data'. Em cargas grandes, é mais barato
+# removê-los e recriá-los de uma vez (uma ordenação só) do que atualizá-los a
+# cada linha inserida. A restrição única (data, station_id) fica, pois o
+# ON CONFLICT precisa dela.
+# Atenção: o DROP INDEX segura um lock ACCESS EXCLUSIVE na tabela até o commit,
+# então as leituras da API ficam bloqueadas enquanto a carga roda.
+SECONDARY_INDEXES = {
+    'ix_pluviometric_data_data':
+        "CREATE INDEX ix_pluviometric_data_data ON pluviometric_data (data)",
+    'ix_pluv_station_data_id':
+        "CREATE INDEX ix_pluv_station_data_id ON pluviometric_data (station_id, data DESC, id DESC) INCLUDE (precipitacao_mm)",
+}
+# Só vale recriar os índices (e bloquear a tabela) se as linhas realmente
+# novas forem muitas perto do que já existe; senão, reconstruir a tabela toda
+# sai caro. Contamos as novas com um anti-join da staging contra a tabela
+# final: numa reingestão dos mesmos arquivos o resultado é zero.
+INDEX_REBUILD_MIN_RATIO = 0.2
+ESTIMATE_ROWS_SQL = "SELECT reltuples::bigint FROM pg_class WHERE oid = 'pluviometric_data'::regclass"
+COUNT_NEW_ROWS_SQL = f"""
+    SELECT count(*)
+    FROM {STAGING_TABLE} stg
+    JOIN stations s ON s.estacao_codigo = stg.estacao_codigo
+    WHERE NOT EXISTS (
+        SELECT 1 FROM pluviometric_data p
+        WHERE p.data = stg.data AND p.station_id = s.id
+    )
+"""
+
+# Recalcula os acumulados mensais usados pelos endpoints de estatística.
+# CONCURRENTLY permite que a API continue lendo a visão durante a atualização.
+REFRESH_MONTHLY_SQL = "REFRESH MATERIALIZED VIEW CONCURRENTLY pluv_monthly_acc"
+
+def _process_single_file(file_path: str) -> pa.Table | None:
     """
     Processa um único arquivo de dados.
+    Retorna uma tabela Arrow já nas colunas do COPY, ou None se o arquivo falhar.
     """
     filename = os.path.basename(file_path)
     print(f"  > Processando arquivo: {filename}...")
 
-    # Pega metadados
-    metadata = {}
+    # Pega metadados: uma leitura do início do arquivo e uma busca por regex
     try:
         with open(file_path, 'r', encoding='latin-1') as f:
-            for i, line in enumerate(f):
-                if 'ESTAÇÃO:' in line:
-                    metadata['cidade'] = line.split(';')[1].strip()
-                elif 'UF:' in line:
-                    metadata['estado'] = line.split(';')[1].strip()
-                elif 'CODIGO (WMO):' in line:
-                    metadata['estacao_codigo'] = line.split(';')[1].strip()
-                if i > 8: break
+            header = f.read(HEADER_READ_SIZE)
     except Exception as e:
         print(f"    [AVISO] Não foi possível ler o cabeçalho de {filename}: {e}")
-        return pd.DataFrame()
+        return None
 
-    # Leitura
-    try:
-        df = pd.read_csv(file_path, skiprows=8, delimiter=';', encoding='latin-1', decimal=',')
-        
-        # Eu vi que muitos arquivos terminam com uma linha vazia.
-        # ao invés de tirar manualmente, isso limpa a linha final que não agrega nada ao sistema
-        if df.iloc[:, -1].isnull().all():
-            df = df.iloc[:, :-1]
+    metadata = {}
+    for key, value in HEADER_RE.findall(header):
+        field = 'cidade' if key.startswith('ESTA') else HEADER_FIELDS[key]
+        metadata[field] = value.strip()
 
-    except Exception as e:
-        print(f"    [ERRO] Falha ao ler o CSV {filename}: {e}")
-        return pd.DataFrame()
+    if len(metadata) < 3:
+        print(f"    [AVISO] Cabeçalho incompleto em {filename} (encontrado: {metadata}).")
+        return None
 
-    # Limpa / transforma
+    # nomes sempre em maiúsculas: as consultas comparam
+    # direto com a coluna, sem lower(), e usam o índice.
+    metadata['cidade'] = metadata['cidade'].upper()
+
+    # Localiza as colunas essenciais na linha de nomes, logo após os metadados
+    header_lines = header.splitlines()
+    columns = header_lines[CSV_HEADER_ROWS].split(';') if len(header_lines) > CSV_HEADER_ROWS else []
     try:
-        col_precipitacao = next(col for col in df.columns if 'PRECIPITA' in col.upper())
-        col_data = next(col for col in df.columns if 'DATA' in col.upper())
+        col_precipitacao = next(col for col in columns if 'PRECIPITA' in col.upper())
+        col_data = next(col for col in columns if 'DATA' in col.upper())
     except StopIteration:
         print(f"    [ERRO] Colunas essenciais (Data, Precipitação) não encontradas em {filename}.")
-        return pd.DataFrame()
+        return None
 
-    df_clean = df[[col_data, col_precipitacao]].copy()
-    df_clean.columns = ['data', 'precipitacao_mm']
+    # Leitura (feita em C++ pelo PyArrow): só as duas colunas, já tipadas
+    try:
+        table = pacsv.read_csv(
+            file_path,
+            read_options=CSV_READ_OPTIONS,
+            parse_options=CSV_PARSE_OPTIONS,
+            convert_options=pacsv.ConvertOptions(
+                include_columns=[col_data, col_precipitacao],
+                column_types={col_data: pa.timestamp('s'), col_precipitacao: pa.float64()},
+                **CSV_CONVERT_ARGS,
+            ),
+        )
+    except Exception as e:
+        print(f"    [ERRO] Falha ao ler o CSV {filename}: {e}")
+        return None
 
-    # por algum motivo, dados que não são registrados, não aconteceram
-    # ou foram invalidados são registrados como "-9999" -> só vamos
-    # automatizar a limpeza aqui.
-    df_clean.replace(-9999, np.nan, inplace=True)
-    df_clean['precipitacao_mm'] = df_clean['precipitacao_mm'].fillna(0)
-    df_clean['data'] = pd.to_datetime(df_clean['data'])
-    df_clean['precipitacao_mm'] = pd.to_numeric(df_clean['precipitacao_mm'])
+    # Precipitação ausente conta como zero; linhas sem data são descartadas.
+    datas = table[col_data].cast(pa.date32())
+    precipitacoes = pc.fill_null(table[col_precipitacao], 0.0)
+    table_clean = pa.table({'data': datas, 'precipitacao_mm': precipitacoes}).filter(pc.is_valid(datas))
 
-    # agregação diária
-    df_daily = df_clean.groupby('data').agg(precipitacao_mm=('precipitacao_mm', 'sum')).reset_index()
+    # agregação diária; tudo continua no Arrow, sem passar pelo pandas
+    table_daily = table_clean.group_by('data') \
+        .aggregate([('precipitacao_mm', 'sum')]) \
+        .rename_columns(['data', 'precipitacao_mm']) \
+        .sort_by('data')
 
     # Adiciona metadados
     for key, value in metadata.items():
-        df_daily[key] = value
+        table_daily = table_daily.append_column(key, pa.array([value] * table_daily.num_rows, pa.string()))
+    table_daily = table_daily.select(COPY_COLUMNS)
+
+    print(f"    -> Concluído: {table_daily.num_rows} registros diários gerados.")
+    return table_daily
+
+
+def _to_copy_buffer(table: pa.Table) -> io.BytesIO:
+    """
+    Serializa a tabela em CSV na memória, no formato esperado pelo COPY.
+    A escrita é feita pelo próprio PyArrow, sem converter para DataFrame.
+    """
+    buffer = io.BytesIO()
+    pacsv.write_csv(table, buffer, write_options=COPY_WRITE_OPTIONS)
+    buffer.seek(0)
+    return buffer
+
+
+def _should_rebuild_indexes(cursor) -> bool:
+    """
+    Decide se os índices secundários devem ser removidos durante a carga,
+    comparando as linhas novas da staging com a estimativa de linhas da tabela.
+    Precisa ser chamada depois do cadastro das estações.
+    """
+    cursor.execute(COUNT_NEW_ROWS_SQL)
+    new_rows = cursor.fetchone()[0]
+    if new_rows == 0:
+        return False
+    cursor.execute(ESTIMATE_ROWS_SQL)
+    existing_rows = max(cursor.fetchone()[0], 0) # -1 = tabela nunca analisada
+    return new_rows >= existing_rows * INDEX_REBUILD_MIN_RATIO
+
 
-    print(f"    -> Concluído: {len(df_daily)} registros diários gerados.")
-    return df_daily
+def find_csv_files(source_directory: str) -> list[str]:
+    """
+    Lista os arquivos CSV do diretório, em ordem alfabética. A extensão é
+    comparada sem diferenciar maiúsculas: os arquivos do INMET vêm como '.CSV'.
+    """
+    return sorted(
+        os.path.join(source_directory, name)
+        for name in os.listdir(source_directory)
+        if name.lower().endswith('.csv')
+    )
 
 
-def process_and_consolidate_data(source_directory: str) -> pd.DataFrame:
+def iter_and_consolidate_data(csv_files: list[str], max_workers: int | None = None):
+    """
+    Processa os arquivos em paralelo e entrega, na ordem da lista, um par
+    (estacao_codigo, tabela) para cada arquivo com dados. Arquivos inválidos
+    ou vazios são pulados. Não acessa o banco.
+    max_workers=None usa um processo por núcleo.
+    """
+    # Os arquivos são independentes entre si: a leitura e a limpeza rodam em
+    # paralelo, em um processo por núcleo, enquanto quem consome o gerador
+    # (ex: envia ao banco) segue trabalhando neste processo.
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        try:
+            for processed_table in executor.map(_process_single_file, csv_files):
+                if processed_table is None or processed_table.num_rows == 0:
+                    continue
+                yield processed_table['estacao_codigo'][0].as_py(), processed_table
+        except BaseException:
+            # Erro aqui ou no consumidor (que fecha o gerador):
+            # descarta os arquivos que ainda não foram processados.
+            executor.shutdown(cancel_futures=True)
+            raise
+
+
+def process_and_consolidate_data(source_directory: str) -> dict:
     """
     Função principal do serviço. Itera sobre todos os arquivos CSV em um diretório,
-    processa cada um e retorna um único DataFrame consolidado.
+    processa cada um e envia o resultado direto para o banco via COPY.
+    Retorna um resumo com a contagem de arquivos e registros.
+    Precisa ser chamada dentro de um app context.
     """
     print(f"Iniciando serviço de ingestão de dados do diretório: '{source_directory}'")
     
     # Encontra todos os arquivos .csv no diretório especificado
-    csv_files = glob.glob(os.path.join(source_directory, '*.csv'))
+    csv_files = find_csv_files(source_directory)
+
+    summary = {
+        'arquivos_encontrados': len(csv_files),
+        'arquivos_processados': 0,
+        'registros_lidos': 0,
+        'estacoes_novas': 0,
+        'registros_inseridos': 0,
+    }
 
     if not csv_files:
         print("Nenhum arquivo .csv encontrado no diretório.")
-        return pd.DataFrame()
+        return summary
 
     print(f"Encontrados {len(csv_files)} arquivos para processar.")
-    
-    all_dataframes = []
-    # realiza a limpeza item a item usando a função privada.
-    # isso é à prova de CSVs vazios. 
-    for file in csv_files:
-        processed_df = _process_single_file(file)
-        if not processed_df.empty:
-            all_dataframes.append(processed_df)
-    
-    if not all_dataframes:
-        print("Nenhum arquivo pôde ser processado com sucesso.")
-        return pd.DataFrame()
 
-    # Consolida todos os dataframes em um só
-    consolidated_df = pd.concat(all_dataframes, ignore_index=True)
+    # O primeiro arquivo é recebido antes de abrir a conexão: nesse ponto os
+    # processos do pool já existem e não herdam o socket do banco.
+    processed_files = iter_and_consolidate_data(csv_files, current_app.config.get('INGEST_WORKERS'))
+    first_file = next(processed_files, None)
+    if first_file is None:
+        print("Nenhum arquivo com dados válidos.")
+        return summary
+
+    # O COPY não passa pelo ORM e evita o custo de montar um INSERT por
+    # linha, mas roda na mesma conexão (e transação) da sessão: o commit
+    # e o rollback ficam com a sessão, e ela devolve a conexão ao pool.
+    connection = db.session.connection().connection
+    cursor = connection.cursor()
+    try:
+        for setting_sql in INGEST_SETTINGS_SQL:
+            cursor.execute(setting_sql)
+        cursor.execute(CREATE_STAGING_SQL)
 
-    # e depois reordena as colunas para um padrão limpo
-    final_columns = ['data', 'precipitacao_mm', 'cidade', 'estado', 'estacao_codigo']
-    consolidated_df = consolidated_df.reindex(columns=final_columns)
+        # os arquivos processados vão para o banco em blocos, sem acumular
+        # tudo na memória.
+        pending, pending_rows = [], 0
+        for _, processed_table in chain([first_file], processed_files):
+            pending.append(processed_table)
+            pending_rows += processed_table.num_rows
+            summary['arquivos_processados'] += 1
+            summary['registros_lidos'] += processed_table.num_rows
 
-    print("\n--- Consolidação finalizada! ---")
-    print(f"Total de registros processados: {len(consolidated_df)}")
+            if pending_rows >= COPY_CHUNK_ROWS:
+                cursor.copy_expert(COPY_SQL, _to_copy_buffer(pa.concat_tables(pending)))
+                pending, pending_rows = [], 0
+
+        if pending:
+            cursor.copy_expert(COPY_SQL, _to_copy_buffer(pa.concat_tables(pending)))
+
+        # Cadastra as estações que ainda não existem...
+        cursor.execute(INSERT_STATIONS_SQL)
+        summary['estacoes_novas'] = cursor.rowcount
+
+        # Em cargas grandes (de linhas novas), os índices secundários saem antes
+        # do INSERT e voltam depois, na mesma transação (um rollback os restaura).
+        rebuild_indexes = _should_rebuild_indexes(cursor)
+        if rebuild_indexes:
+            print("Carga grande: removendo índices secundários durante a inserção...")
+            for index_name in SECONDARY_INDEXES:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+
+        # ...e move tudo da staging para a tabela final de uma vez só.
+        # Se um registro com a mesma 'data' e estação já existir,
+        # ele é simplesmente ignorado.
+        cursor.execute(INSERT_FROM_STAGING_SQL)
+        summary['registros_inseridos'] = cursor.rowcount
+
+        if rebuild_indexes:
+            print("Recriando índices secundários...")
+            for create_index_sql in SECONDARY_INDEXES.values():
+                cursor.execute(create_index_sql)
+
+        if summary['registros_inseridos']:
+            cursor.execute(REFRESH_MONTHLY_SQL)
+        db.session.commit()
+    except Exception:
+        # Qualquer falha desfaz a transação inteira
+        # e descarta os arquivos que ainda não foram processados.
+        db.session.rollback()
+        processed_files.close()
+        raise
+    finally:
+        cursor.close()
+
+    # Novas cidades podem ter chegado: descarta a lista de cidades em cache.
+    if summary['estacoes_novas']:
+        try:
+            cache.delete(CITIES_CACHE_KEY)
+        except Exception as e:
+            print(f"[AVISO] Não foi possível limpar o cache de cidades: {e}")
+
+    print("\n--- Ingestão finalizada! ---")
+    print(f"Total de registros processados: {summary['registros_lidos']}")
+    print(f"Total de registros inseridos: {summary['registros_inseridos']}")
     
-    return consolidated_df
+    return summary
 
 
-# Este bloco só será executado quando você rodar o script diretamente
+# Este bloco só será executado quando você rodar o módulo diretamente:
+#   python -m app.services.ingest_service
 if __name__ == '__main__':
     # O caminho é relativo à localização do projeto, ! não do script !
     # Supondo que você execute o comando da pasta raiz do projeto
     DATA_FOLDER = 'data'
-    
-    final_data = process_and_consolidate_data(DATA_FOLDER)
-
-    if not final_data.empty:
-        print("\n--- Amostra dos Dados Consolidados ---")
-        print("Primeiros 5 registros:")
-        print(final_data.head())
-        print("\nÚltimos 5 registros:")
-        print(final_data.tail())
-        print(f"\nCidades encontradas: {final_data['cidade'].unique().tolist()}")
\ No newline at end of file
+
+    from app import create_app
+
+    app = create_app()
+    with app.app_context():
+        result = process_and_consolidate_data(DATA_FOLDER)
+
+    print("\n--- Resumo da Ingestão ---")
+    for key, value in result.items():
+        print(f"{key}: {value}")
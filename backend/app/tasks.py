@@ -0,0 +1,37 @@
+"""
+Tarefas executadas em segundo plano pelo worker do RQ.
+
+O worker roda em outro processo, então cada tarefa precisa da sua própria
+instância da aplicação (e do app context) para acessar o banco.
+Para iniciar o worker, a partir da pasta backend:
+    rq worker forecasts --url redis://localhost:6379/0
+"""
+from app.services import forecast_service
+
+_app = None
+
+def _get_app():
+    """Cria a aplicação uma única vez por processo do worker."""
+    global _app
+    if _app is None:
+        from app import create_app
+        _app = create_app()
+    return _app
+
+def generate_forecast_task(city_name: str, cache_path: str) -> dict:
+    """
+    Gera (ou regenera) a previsão de uma cidade e salva o cache.
+    Se a previsão não puder ser gerada, a tarefa falha com a mensagem do motivo.
+    """
+    app = _get_app()
+    with app.app_context():
+        forecast_result, _ = forecast_service.generate_forecast_for_city(city_name, cache_path, force_regenerate=True)
+
+    if forecast_result is None:
+        # Isso pode acontecer se não houver dados suficientes para a cidade
+        raise ValueError(f'Não foi possível gerar a previsão. Verifique se existem dados suficientes para a cidade "{city_name}".')
+
+    return {
+        'message': f'Previsão para {city_name} foi gerada e salva com sucesso.',
+        'cache_path': cache_path
+    }
@@ -0,0 +1,20 @@
+import re
+import unicodedata
+from functools import lru_cache
+
+
+@lru_cache(maxsize=256)
+def slugify(name: str) -> str:
+    """
+    Converte o nome de uma cidade em um trecho seguro para nomes de arquivo.
+    É a única fonte das chaves de cache da previsão: a API, o worker e a CLI
+    precisam chegar ao mesmo arquivo para a mesma cidade.
+    Ex: "São José" -> "sao_jose"; "CURITIBANOS" -> "curitibanos"
+    """
+    ascii_name = unicodedata.normalize('NFKD', name).encode('ascii', 'ignore').decode()
+    return re.sub(r'[^a-z0-9]+', '_', ascii_name.lower()).strip('_')
+
+
+def forecast_cache_filename(city_name: str) -> str:
+    """Nome do arquivo de cache da previsão de uma cidade (dentro de 'instance')."""
+    return f"{slugify(city_name)}_forecast.json"
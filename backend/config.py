@@ -27,4 +27,44 @@ class Config:
     )
 
     # Desativa um recurso do Flask-SQLAlchemy que não usaremos e que consome recursos.
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+    # Opções repassadas ao create_engine. A carga principal usa COPY, mas
+    # qualquer execute() com uma lista de parâmetros (executemany) sai em
+    # lotes: INSERTs em VALUES de várias linhas, UPDATE/DELETE via execute_batch.
+    #
+    # O pool comporta a API e uma ingestão/previsão rodando ao mesmo tempo;
+    # pre_ping descarta conexões que o servidor já fechou, e recycle renova
+    # as antigas antes que algum firewall/proxy as derrube.
+    # Consultas da API passam de um minuto só por erro; a ingestão desliga
+    # esse limite na própria transação.
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'executemany_mode': 'values_plus_batch',
+        'insertmanyvalues_page_size': 10000,
+        'executemany_batch_page_size': 500,
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+        'pool_pre_ping': True,
+        'pool_recycle': 1800,
+        'connect_args': {
+            'options': f"-c statement_timeout={os.environ.get('DB_STATEMENT_TIMEOUT_MS', 60000)}"
+        },
+    }
+
+    # Processos usados para ler os CSVs na ingestão (vazio = um por núcleo)
+    INGEST_WORKERS = int(os.environ['INGEST_WORKERS']) if os.environ.get('INGEST_WORKERS') else None
+
+    # CONFIGURAÇÃO DO REDIS (CACHE E FILA DE TAREFAS)
+
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+
+    # Respostas que mudam apenas a cada ingestão (ex: lista de cidades)
+    # ficam guardadas no Redis, evitando idas ao banco a cada requisição.
+    CACHE_TYPE = os.environ.get('CACHE_TYPE', 'RedisCache')
+    CACHE_REDIS_URL = REDIS_URL
+    CACHE_DEFAULT_TIMEOUT = 3600
+
+    # Fila do RQ onde as previsões são geradas, fora do ciclo da requisição.
+    # O worker deve escutar esta mesma fila: rq worker forecasts
+    TASK_QUEUE_NAME = 'forecasts'
+    FORECAST_JOB_TIMEOUT = 30 * 60 # em segundos; o auto_arima pode demorar
@@ -104,6 +104,9 @@ def run_migrations_online():
         )
 
         with context.begin_transaction():
+            # as conexões da aplicação têm statement_timeout (ver config.py);
+            # migrações que reescrevem a tabela podem passar disso.
+            connection.exec_driver_sql("SET LOCAL statement_timeout = 0")
             context.run_migrations()
 
 
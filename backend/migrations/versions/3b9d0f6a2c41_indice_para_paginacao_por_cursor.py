@@ -0,0 +1,26 @@
+"""Índice para paginação por cursor dos registros de uma cidade
+
+Revision ID: 3b9d0f6a2c41
+Revises: e710ee5518ed
+Create Date: 2025-10-20 10:12:43.518204
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9d0f6a2c41'
+down_revision = 'e710ee5518ed'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.create_index('ix_pluv_cidade_data_id', ['cidade', sa.text('data DESC'), sa.text('id DESC')], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_pluv_cidade_data_id')
@@ -0,0 +1,28 @@
+"""Normaliza o nome das cidades em maiúsculas
+
+Revision ID: 7c2e5a91d3f8
+Revises: 3b9d0f6a2c41
+Create Date: 2025-10-20 11:03:27.904615
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7c2e5a91d3f8'
+down_revision = '3b9d0f6a2c41'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # As consultas passaram a comparar 'cidade' diretamente (sem lower()),
+    # o que permite usar o índice ix_pluv_cidade_data_id. Para isso, os
+    # registros já existentes precisam seguir o padrão da ingestão.
+    op.execute("UPDATE pluviometric_data SET cidade = upper(cidade) WHERE cidade <> upper(cidade)")
+
+
+def downgrade():
+    # Não há como recuperar a grafia original, e maiúsculas continuam válidas.
+    pass
@@ -0,0 +1,35 @@
+"""Cria a visão materializada de acumulado mensal por cidade
+
+Revision ID: b5e8f4c07a19
+Revises: 7c2e5a91d3f8
+Create Date: 2025-10-20 14:41:09.277381
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b5e8f4c07a19'
+down_revision = '7c2e5a91d3f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute("""
+        CREATE MATERIALIZED VIEW pluv_monthly_acc AS
+        SELECT
+            cidade,
+            extract(year FROM data)::int AS ano,
+            extract(month FROM data)::int AS mes,
+            SUM(precipitacao_mm) AS acumulado_mm
+        FROM pluviometric_data
+        GROUP BY 1, 2, 3
+    """)
+    # O índice único é obrigatório para o REFRESH ... CONCURRENTLY
+    op.execute("CREATE UNIQUE INDEX ix_pluv_monthly_acc_cidade_ano_mes ON pluv_monthly_acc (cidade, ano, mes)")
+
+
+def downgrade():
+    op.execute("DROP MATERIALIZED VIEW IF EXISTS pluv_monthly_acc")
@@ -0,0 +1,125 @@
+"""Move os dados das estações para a tabela stations
+
+Revision ID: d41a7e2f9c63
+Revises: b5e8f4c07a19
+Create Date: 2025-10-21 09:26:51.730842
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd41a7e2f9c63'
+down_revision = 'b5e8f4c07a19'
+branch_labels = None
+depends_on = None
+
+
+MONTHLY_ACC_BY_STATION = """
+    CREATE MATERIALIZED VIEW pluv_monthly_acc AS
+    SELECT
+        s.cidade,
+        extract(year FROM p.data)::int AS ano,
+        extract(month FROM p.data)::int AS mes,
+        SUM(p.precipitacao_mm) AS acumulado_mm
+    FROM pluviometric_data p
+    JOIN stations s ON s.id = p.station_id
+    GROUP BY 1, 2, 3
+"""
+
+MONTHLY_ACC_BY_COLUMN = """
+    CREATE MATERIALIZED VIEW pluv_monthly_acc AS
+    SELECT
+        cidade,
+        extract(year FROM data)::int AS ano,
+        extract(month FROM data)::int AS mes,
+        SUM(precipitacao_mm) AS acumulado_mm
+    FROM pluviometric_data
+    GROUP BY 1, 2, 3
+"""
+
+MONTHLY_ACC_INDEX = "CREATE UNIQUE INDEX ix_pluv_monthly_acc_cidade_ano_mes ON pluv_monthly_acc (cidade, ano, mes)"
+
+
+def upgrade():
+    op.create_table('stations',
+    sa.Column('id', sa.SmallInteger(), nullable=False),
+    sa.Column('cidade', sa.String(length=100), nullable=False),
+    sa.Column('estado', sa.String(length=2), nullable=False),
+    sa.Column('estacao_codigo', sa.String(length=10), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('estacao_codigo')
+    )
+    with op.batch_alter_table('stations', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_stations_cidade'), ['cidade'], unique=False)
+
+    # Uma linha por estação, com o nome mais recente que ela usou
+    op.execute("""
+        INSERT INTO stations (cidade, estado, estacao_codigo)
+        SELECT DISTINCT ON (estacao_codigo) cidade, estado, estacao_codigo
+        FROM pluviometric_data
+        ORDER BY estacao_codigo, data DESC
+    """)
+
+    # A visão depende da coluna 'cidade', que vai sair da tabela
+    op.execute("DROP MATERIALIZED VIEW pluv_monthly_acc")
+
+    op.add_column('pluviometric_data', sa.Column('station_id', sa.SmallInteger(), nullable=True))
+    op.execute("""
+        UPDATE pluviometric_data p
+        SET station_id = s.id
+        FROM stations s
+        WHERE s.estacao_codigo = p.estacao_codigo
+    """)
+
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.alter_column('station_id', existing_type=sa.SmallInteger(), nullable=False)
+        batch_op.create_foreign_key('fk_pluviometric_data_station_id', 'stations', ['station_id'], ['id'])
+        batch_op.drop_constraint('_data_estacao_uc', type_='unique')
+        batch_op.drop_index('ix_pluv_cidade_data_id')
+        batch_op.drop_index(batch_op.f('ix_pluviometric_data_estacao_codigo'))
+        batch_op.drop_column('estacao_codigo')
+        batch_op.drop_column('estado')
+        batch_op.drop_column('cidade')
+        batch_op.create_unique_constraint('_data_estacao_uc', ['data', 'station_id'])
+        batch_op.create_index('ix_pluv_station_data_id', ['station_id', sa.text('data DESC'), sa.text('id DESC')], unique=False)
+
+    op.execute(MONTHLY_ACC_BY_STATION)
+    op.execute(MONTHLY_ACC_INDEX)
+
+
+def downgrade():
+    op.execute("DROP MATERIALIZED VIEW pluv_monthly_acc")
+
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_pluv_station_data_id')
+        batch_op.drop_constraint('_data_estacao_uc', type_='unique')
+        batch_op.add_column(sa.Column('cidade', sa.String(length=100), nullable=True))
+        batch_op.add_column(sa.Column('estado', sa.String(length=2), nullable=True))
+        batch_op.add_column(sa.Column('estacao_codigo', sa.String(length=10), nullable=True))
+
+    op.execute("""
+        UPDATE pluviometric_data p
+        SET cidade = s.cidade, estado = s.estado, estacao_codigo = s.estacao_codigo
+        FROM stations s
+        WHERE s.id = p.station_id
+    """)
+
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.alter_column('cidade', existing_type=sa.String(length=100), nullable=False)
+        batch_op.alter_column('estado', existing_type=sa.String(length=2), nullable=False)
+        batch_op.alter_column('estacao_codigo', existing_type=sa.String(length=10), nullable=False)
+        batch_op.drop_constraint('fk_pluviometric_data_station_id', type_='foreignkey')
+        batch_op.drop_column('station_id')
+        batch_op.create_unique_constraint('_data_estacao_uc', ['data', 'estacao_codigo'])
+        batch_op.create_index(batch_op.f('ix_pluviometric_data_estacao_codigo'), ['estacao_codigo'], unique=False)
+        batch_op.create_index('ix_pluv_cidade_data_id', ['cidade', sa.text('data DESC'), sa.text('id DESC')], unique=False)
+
+    op.execute(MONTHLY_ACC_BY_COLUMN)
+    op.execute(MONTHLY_ACC_INDEX)
+
+    with op.batch_alter_table('stations', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_stations_cidade'))
+
+    op.drop_table('stations')
@@ -0,0 +1,30 @@
+"""Inclui a precipitação no índice por estação (index-only scan)
+
+Revision ID: f2c7d8a4b1e5
+Revises: d41a7e2f9c63
+Create Date: 2025-10-21 16:04:18.302917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2c7d8a4b1e5'
+down_revision = 'd41a7e2f9c63'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Com 'precipitacao_mm' no INCLUDE, a consulta por estação e data (e as
+    # páginas da listagem) saem só do índice, sem visitar a tabela.
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_pluv_station_data_id')
+        batch_op.create_index('ix_pluv_station_data_id', ['station_id', sa.text('data DESC'), sa.text('id DESC')], unique=False, postgresql_include=['precipitacao_mm'])
+
+
+def downgrade():
+    with op.batch_alter_table('pluviometric_data', schema=None) as batch_op:
+        batch_op.drop_index('ix_pluv_station_data_id')
+        batch_op.create_index('ix_pluv_station_data_id', ['station_id', sa.text('data DESC'), sa.text('id DESC')], unique=False)
@@ -6,6 +6,8 @@ call .\.venv\Scripts\activate.bat
 
 start cmd /k "flask run"
 
+start cmd /k "rq worker forecasts -w rq.worker.SimpleWorker"
+
 cd ..\frontend
 
 start cmd /k "npm run dev"